@@ -1,22 +1,38 @@
 """
 - Connects to a MongoDB collection.
-- Infers a SQL Server table schema (scans sample documents).
+- Infers a SQL Server table schema (scans a random $sample of documents).
 - Creates a table (if doesn't exist) with same name as collection. Setting to allow 'drop and recreating' or using existing table.
 - Inserts documents (converting nested objects to JSON, ObjectId -> str, Decimal128 -> Decimal).
 """
 
+import asyncio
 import pymongo
+from pymongo import AsyncMongoClient
 import pyodbc
 import json
+try:
+    import orjson    # optional, faster JSON for nested objects/lists
+except ImportError:
+    orjson = None
 import decimal
+import bson
 from bson import ObjectId, Decimal128, Int64
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 import datetime
-from collections import defaultdict
+import logging
+import math
+import struct
+import sys
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 # ---------------- CONFIG ----------------
 COLLECTION_NAMES = "coll_1;coll_2;coll_3;coll_4" 
 
 ReCreateIfExists = 1        # 0 = keep table, 1 = drop & recreate
+SORT_COLUMNS = 0            # 0 = columns in first-seen field order, 1 = sorted by name (after _id)
 
 MONGO_URI = "mongodb://localhost:27017/"
 MONGO_DB = "TestMongoData"
@@ -24,76 +40,224 @@ SQL_CONN = "SERVER=localhost;DATABASE=TestMongoToSql;Trusted_Connection=yes;"
 #SQL_CONN = "SERVER=localhost\\SQLEXPRESS;DATABASE=TestMongoToSql;Trusted_Connection=yes;"
 #SQL_CONN = "SERVER=localhost;DATABASE=TestMongoToSql;UID=XXXX;PWD=XXXXX;"
 
-SAMPLE_SIZE = 1000    # number of docs to scan for schema inference; set 0 or None to scan entire collection
-BATCH_INSERT = 500    # commit every N rows
+SAMPLE_SIZE = 1000    # number of randomly sampled docs ($sample) for schema inference; set 0 or None to scan entire collection
+FULL_FIELD_SCAN = 1   # 1 = also collect every field name server-side so fields missing from the sample still get a column
+MAX_PARALLEL_COLLECTIONS = 4   # collections loaded in parallel worker processes (also capped by CPU count); 1 = one after another.
+                               # keep it within what the SQL Server log throughput can sustain
+BATCH_INSERT = 500    # rows sent per executemany batch (commit every N rows)
+BULK_STAGING_DIR = None   # folder for BULK INSERT staging CSV files (SQL Server 2017+); must resolve to the same path on the SQL Server
+                          # machine (e.g. a UNC share). None = insert with fast_executemany only
+POST_LOAD_INDEXES = {}    # table -> {index name: CREATE INDEX statement} run after the load unless the index already exists,
+                          # e.g. {"coll_1": {"IX_coll_1_siteId": "CREATE INDEX IX_coll_1_siteId ON [dbo].[coll_1] ([siteId])"}}
+BULK_LOGGED_LOAD = 0      # 1 = switch a FULL recovery database to BULK_LOGGED during the load (needs ALTER DATABASE permission); only used with BULK_STAGING_DIR
+ASCII_AS_VARCHAR = 0      # 1 = string columns that are ASCII-only in the sample become VARCHAR (and ObjectId VARCHAR(24));
+                          # tables without NVARCHAR columns then send strings as UTF-8. Non-ASCII values outside the
+                          # sample would be converted to the column code page, so only use it for ASCII data
 DECIMAL_PRECISION = 38
 DECIMAL_SCALE = 18
 # ----------------------------------------
 
+logger = logging.getLogger(__name__)
+
 # helper ranges for int and bigint
 INT32_MIN = -2**31
 INT32_MAX = 2**31 - 1
 INT64_MIN = -2**63
 INT64_MAX = 2**63 - 1
 
-def analyze_collection_schema(collection, sample_size=1000):
-    """Scan documents and gather type statistics per field."""
+# schema type bits; a field's "types" is the OR of the bits seen (see sql_type_from_stats)
+TYPE_NULL = 1
+TYPE_BOOL = 2
+TYPE_INT = 4
+TYPE_FLOAT = 8
+TYPE_DEC = 16
+TYPE_DT = 32
+TYPE_STR = 64
+TYPE_OID = 128
+TYPE_JSON = 256
+TYPE_BYTES = 512
+
+# value sizes for variable-width BSON elements (fixed-width elements use their size in bytes)
+BSON_STRING = -1        # int32 byte length (incl. NUL) + utf-8 bytes
+BSON_DOCUMENT = -2      # int32 total length
+BSON_BINARY = -3        # int32 length + subtype byte + data
+BSON_OTHER = -4         # regex, db pointer, javascript code (with scope)
+
+# BSON element type byte -> (schema type bit, value size)
+# one lookup per element gives both the tag and how to skip the value; other types are stored as strings
+BSON_ELEMENT = {
+    0x01: (TYPE_FLOAT, 8),            # double
+    0x02: (TYPE_STR, BSON_STRING),
+    0x03: (TYPE_JSON, BSON_DOCUMENT), # embedded document
+    0x04: (TYPE_JSON, BSON_DOCUMENT), # array
+    0x05: (TYPE_BYTES, BSON_BINARY),
+    0x06: (TYPE_NULL, 0),             # undefined (decodes to None)
+    0x07: (TYPE_OID, 12),
+    0x08: (TYPE_BOOL, 1),
+    0x09: (TYPE_DT, 8),
+    0x0A: (TYPE_NULL, 0),
+    0x0B: (TYPE_STR, BSON_OTHER),     # regex
+    0x0C: (TYPE_STR, BSON_OTHER),     # db pointer
+    0x0D: (TYPE_STR, BSON_OTHER),     # javascript code
+    0x0E: (TYPE_STR, BSON_STRING),    # symbol (decodes to str)
+    0x0F: (TYPE_STR, BSON_OTHER),     # javascript code with scope
+    0x10: (TYPE_INT, 4),              # int32
+    0x11: (TYPE_STR, 8),              # timestamp
+    0x12: (TYPE_INT, 8),              # int64
+    0x13: (TYPE_DEC, 16),             # decimal128
+    0x7F: (TYPE_STR, 0),              # max key
+    0xFF: (TYPE_STR, 0),              # min key
+}
+
+BSON_INT32 = struct.Struct("<i")
+BSON_INT64 = struct.Struct("<q")
+
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+# per-field stats start as a copy of this (all values immutable, so a shallow copy is enough)
+FIELD_STATS_TEMPLATE = {
+    "types": 0,
+    "count": 0,
+    "int_min": None,
+    "int_max": None,
+    "max_str_len": 0,
+    "ascii": True,      # only checked for BSON strings when ASCII_AS_VARCHAR is set
+}
+
+def new_field_stats():
+    return FIELD_STATS_TEMPLATE.copy()
+
+def skip_other_element(buf, off, btype):
+    """Return the offset past a rare variable-width BSON value (BSON_OTHER)."""
+    if btype == 0x0B:
+        # regex: pattern cstring + options cstring
+        return buf.index(0, buf.index(0, off) + 1) + 1
+    if btype == 0x0C:
+        # db pointer: string + 12 byte ObjectId
+        return off + 4 + BSON_INT32.unpack_from(buf, off)[0] + 12
+    if btype == 0x0D:
+        # javascript code: string
+        return off + 4 + BSON_INT32.unpack_from(buf, off)[0]
+    # code with scope: int32 total length
+    return off + BSON_INT32.unpack_from(buf, off)[0]
+
+def scan_raw_document(stats, raw_doc, field_entries=None):
+    """Update field stats from the BSON bytes of a RawBSONDocument, without decoding values to python objects.
+
+    field_entries: cache of raw key bytes -> stats entry shared across documents, so each field name
+    is decoded (and interned) only once per scan."""
+    if field_entries is None:
+        field_entries = {}
+    buf = raw_doc.raw
+    find_nul = buf.index
+    entries_get = field_entries.get
+    element_get = BSON_ELEMENT.get
+    unpack_i32 = BSON_INT32.unpack_from
+    unpack_i64 = BSON_INT64.unpack_from
+    check_ascii = ASCII_AS_VARCHAR
+    off = 4                     # skip document length
+    end = len(buf) - 1          # trailing NUL
+    while off < end:
+        btype = buf[off]
+        key_end = find_nul(0, off + 1)
+        key_bytes = buf[off + 1:key_end]
+        off = key_end + 1
+
+        st = entries_get(key_bytes)
+        if st is None:
+            key = sys.intern(key_bytes.decode("utf-8"))
+            st = stats.get(key)
+            if st is None:
+                st = stats[key] = new_field_stats()
+            field_entries[key_bytes] = st
+        st["count"] += 1
+        element = element_get(btype)
+        if element is None:
+            raise ValueError(f"Unsupported BSON element type 0x{btype:02x} for field '{key_bytes.decode()}'")
+        tag, size = element
+        st["types"] |= tag
+
+        if size >= 0:
+            if tag == TYPE_INT:
+                v = unpack_i32(buf, off)[0] if size == 4 else unpack_i64(buf, off)[0]
+                lo = st["int_min"]
+                if lo is None or v < lo:
+                    st["int_min"] = v
+                hi = st["int_max"]
+                if hi is None or v > hi:
+                    st["int_max"] = v
+            elif tag == TYPE_STR:
+                # timestamp / min key / max key are stored as their string form
+                value_len = len(str(raw_doc[key_bytes.decode("utf-8")]))
+                if value_len > st["max_str_len"]:
+                    st["max_str_len"] = value_len
+            off += size
+        elif size == BSON_STRING:
+            # utf-8 byte length from the BSON prefix (minus the NUL), without decoding the string;
+            # bytes >= characters, so this only ever over-sizes the column
+            strlen = unpack_i32(buf, off)[0]
+            if strlen - 1 > st["max_str_len"]:
+                st["max_str_len"] = strlen - 1
+            if check_ascii and st["ascii"] and not buf[off + 4:off + 3 + strlen].isascii():
+                st["ascii"] = False
+            off += 4 + strlen
+        elif size == BSON_DOCUMENT:
+            off += unpack_i32(buf, off)[0]
+        elif size == BSON_BINARY:
+            off += 5 + unpack_i32(buf, off)[0]
+        else:
+            # stored as their string form
+            text = str(raw_doc[key_bytes.decode("utf-8")])
+            if len(text) > st["max_str_len"]:
+                st["max_str_len"] = len(text)
+            if not text.isascii():
+                st["ascii"] = False
+            off = skip_other_element(buf, off, btype)
+
+def collect_field_names(collection):
+    """Return all top-level field names in the collection, computed server-side without returning documents."""
+    pipeline = [
+        {"$project": {"kv": {"$objectToArray": "$$ROOT"}}},
+        {"$unwind": "$kv"},
+        {"$group": {"_id": None, "fields": {"$addToSet": "$kv.k"}}},
+    ]
+    with collection.aggregate(pipeline, allowDiskUse=True) as cursor:
+        for result in cursor:
+            return result["fields"]
+    return []
+
+def analyze_collection_schema(collection, sample_size=1000, sample_docs=None):
+    """Scan documents and gather type statistics per field.
+
+    sample_docs: optional list receiving the sampled raw documents, so the insert pass can reuse them."""
     stats = {}
     total_docs = 0
 
-    cursor = collection.find({})
-    for i, doc in enumerate(cursor):
-        if sample_size and sample_size > 0 and i >= sample_size:
-            break
-        total_docs += 1
-        # ensure keys in stats
-        for key in doc.keys():
+    # read the sample as raw BSON; field types are classified from the BSON type bytes
+    raw_collection = collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+    if sample_size and sample_size > 0:
+        # random sample straight from the storage engine instead of reading the first N docs in natural order
+        cursor = raw_collection.aggregate(
+            [{"$sample": {"size": int(sample_size)}}],
+            allowDiskUse=True,
+            batchSize=min(int(sample_size), 1000),
+        )
+    else:
+        cursor = raw_collection.find({}, batch_size=1000)
+    field_entries = {}
+    with cursor:
+        for raw_doc in cursor:
+            total_docs += 1
+            scan_raw_document(stats, raw_doc, field_entries)
+            if sample_docs is not None and sample_size and sample_size > 0:
+                sample_docs.append(raw_doc)
+
+    if sample_size and sample_size > 0 and FULL_FIELD_SCAN:
+        # fields missing from the sample (rare or recently added) -> no type info, stored as NVARCHAR(MAX) NULL
+        for key in collect_field_names(collection):
             if key not in stats:
-                stats[key] = {
-                    "types": set(),
-                    "count": 0,
-                    "int_min": None,
-                    "int_max": None,
-                    "max_str_len": 0,
-                }
-        # update counts for seen fields
-        for key, value in doc.items():
-            st = stats[key]
-            st["count"] += 1
-            # detect types
-            if value is None:
-                st["types"].add("null")
-            elif isinstance(value, bool):
-                st["types"].add("bool")
-            elif isinstance(value, (Int64,)) or (isinstance(value, int) and not isinstance(value, bool)):
-                st["types"].add("int")
-                v = int(value)
-                if st["int_min"] is None or v < st["int_min"]:
-                    st["int_min"] = v
-                if st["int_max"] is None or v > st["int_max"]:
-                    st["int_max"] = v
-            elif isinstance(value, float):
-                st["types"].add("float")
-            elif isinstance(value, (Decimal128, decimal.Decimal)):
-                st["types"].add("decimal")
-            elif isinstance(value, datetime.datetime):
-                st["types"].add("datetime")
-            elif isinstance(value, str):
-                st["types"].add("str")
-                st["max_str_len"] = max(st["max_str_len"], len(value))
-            elif isinstance(value, ObjectId):
-                st["types"].add("objectid")
-            elif isinstance(value, (list, dict)):
-                st["types"].add("json")
-            elif isinstance(value, (bytes, bytearray, memoryview)):
-                st["types"].add("bytes")
-            else:
-                # fallback, treat as string
-                st["types"].add("str")
-                try:
-                    st["max_str_len"] = max(st["max_str_len"], len(str(value)))
-                except Exception:
-                    pass
+                st = stats[key] = new_field_stats()
+                st["types"] |= TYPE_NULL
 
     # fields that never appeared (shouldn't happen) -> ignore
     # determine nullable fields (if occurrence < total_docs)
@@ -106,41 +270,41 @@ def sql_type_from_stats(st):
     """Return SQL Server column type (string) given stats for field."""
     types = st["types"]
     # if only nulls
-    if types == {"null"}:
+    if types == TYPE_NULL:
         return f"NVARCHAR(MAX)"
 
     # if JSON present or mixed containing json -> NVARCHAR(MAX)
-    if "json" in types:
+    if types & TYPE_JSON:
         return "NVARCHAR(MAX)"
 
     # bytes
-    if types == {"bytes"}:
+    if types == TYPE_BYTES:
         return "VARBINARY(MAX)"
 
     # object id
-    if types == {"objectid"} or ("objectid" in types and len(types) == 1):
+    if types == TYPE_OID:
         # store as hex string e.g. "60b8..."
-        return "NVARCHAR(24)"
+        return "VARCHAR(24)" if ASCII_AS_VARCHAR else "NVARCHAR(24)"
 
     # boolean
-    if types == {"bool"}:
+    if types == TYPE_BOOL:
         return "BIT"
 
     # datetime
-    if types == {"datetime"}:
+    if types == TYPE_DT:
         return "DATETIME2"
 
     # decimal related
-    if "decimal" in types and types.issubset({"decimal", "int"}):
+    if types & TYPE_DEC and not types & ~(TYPE_DEC | TYPE_INT):
         # choose DECIMAL to preserve precision (use default precision/scale)
         return f"DECIMAL({DECIMAL_PRECISION},{DECIMAL_SCALE})"
 
     # float (or int+float)
-    if "float" in types:
+    if types & TYPE_FLOAT:
         return "FLOAT"
 
     # integer-only
-    if types == {"int"} or types == {"int", "null"}:
+    if types == TYPE_INT or types == TYPE_INT | TYPE_NULL:
         # decide INT vs BIGINT based on min/max
         lo = st["int_min"]
         hi = st["int_max"]
@@ -156,12 +320,24 @@ def sql_type_from_stats(st):
         return f"DECIMAL({DECIMAL_PRECISION},0)"
 
     # string rules: if only strings (or str + null)
-    if types.issubset({"str", "null"}):
+    if not types & ~(TYPE_STR | TYPE_NULL):
         maxlen = st.get("max_str_len", 0) or 0
+        if ASCII_AS_VARCHAR and st.get("ascii"):
+            # ASCII-only in the sample: 1 byte per character, half the size of NVARCHAR
+            if maxlen <= 1:
+                return "CHAR(1)"
+            if maxlen <= 255:
+                return "VARCHAR(255)"
+            if maxlen <= 8000:
+                return "VARCHAR(8000)"
+            return "VARCHAR(MAX)"
         if maxlen <= 1:
             return "NCHAR(1)"
         if maxlen <= 255:
             return "NVARCHAR(255)"
+        # fast_executemany sizes its parameter buffers from the declared width, so avoid MAX when possible
+        if maxlen <= 4000:
+            return "NVARCHAR(4000)"
         # longer -> NVARCHAR(MAX)
         return "NVARCHAR(MAX)"
 
@@ -194,115 +370,436 @@ END
 """
     return create_stmt
 
-def convert_value_for_sql(value):
-    """Convert BSON/python value into something pyodbc  friendly for insertion."""
-    if value is None:
-        return None
+def keep_value(value):
+    return value
+
+def convert_decimal128(value):
+    # Decimal128 -> decimal.Decimal
+    # (the raw 16 bytes can't be bound as-is: BSON Decimal128 is IEEE 754 BID, not SQL Server's DECIMAL layout)
+    try:
+        return value.to_decimal()
+    except Exception:
+        return decimal.Decimal(str(value))
+
+def json_default(value):
+    # like orjson: ISO 8601 datetimes with "T", everything else (ObjectId, Decimal128, ...) through str
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+def json_finite(value):
+    """Copy of a nested value with NaN/Infinity floats replaced by None."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: json_finite(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_finite(v) for v in value]
+    return value
+
+def convert_json(value):
+    if orjson is not None:
+        try:
+            # datetimes are serialized natively; ObjectId/Decimal128/Decimal/bytes go through str
+            return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits or nesting too deep for orjson
+            pass
+    # compact, non-ASCII kept as-is and ISO datetimes like orjson (float text may still differ, e.g. 1e-05 vs 0.00001)
+    try:
+        return json.dumps(value, default=json_default, separators=(",", ":"), ensure_ascii=False, allow_nan=False)
+    except ValueError:
+        # NaN/Infinity are not valid JSON: store them as null, as orjson does
+        return json.dumps(json_finite(value), default=json_default, separators=(",", ":"), ensure_ascii=False)
+
+def convert_fallback(value):
+    """Conversion for types not in CONV (subclasses, other BSON types)."""
     if isinstance(value, ObjectId):
         return str(value)   # 24-char hex
     if isinstance(value, Decimal128):
-        # Decimal128 -> decimal.Decimal
-        try:
-            return value.to_decimal()
-        except Exception:
-            return decimal.Decimal(str(value))
-    if isinstance(value, decimal.Decimal):
-        return value
+        return convert_decimal128(value)
     if isinstance(value, (list, dict)):
-        return json.dumps(value, default=str)
+        return convert_json(value)
     if isinstance(value, bytes):
         return value
-    if isinstance(value, bytearray):
+    if isinstance(value, (bytearray, memoryview)):
         return bytes(value)
-    if isinstance(value, memoryview):
-        return bytes(value)
-    # datetime is ok
-    if isinstance(value, datetime.datetime):
-        return value
-    # booleans, ints, floats, strings are fine
+    # datetime, booleans, ints, floats, strings are fine
     return value
 
-def create_table_and_insert(mongo_collection, sql_conn, table_name, sample_size=1000):
-    stats, total = analyze_collection_schema(mongo_collection, sample_size=sample_size)
+# exact python type -> converter; one dict lookup per cell instead of an isinstance chain
+CONV = {
+    type(None): keep_value,
+    bool: keep_value,
+    int: keep_value,
+    Int64: keep_value,
+    float: keep_value,
+    str: keep_value,
+    bytes: keep_value,
+    # datetimes stay datetime objects: decoding them as DatetimeMS ints to bind via DATEADD is slower in bson's C decoder
+    datetime.datetime: keep_value,
+    decimal.Decimal: keep_value,
+    ObjectId: str,          # 24-char hex
+    Decimal128: convert_decimal128,
+    list: convert_json,
+    dict: convert_json,
+    bytearray: bytes,
+    memoryview: bytes,
+}
+
+def build_row_projection(columns):
+    """Compile a function mapping a document to its converted row tuple for a fixed column list."""
+    # unrolled at runtime: one d.get per column and the CONV dispatch inlined, no per-row loop or generator
+    # (dicts/lists are dumped to JSON by CONV; scalars in a mixed JSON column keep their own conversion)
+    lines = ["def project(d, _get=_get, _fallback=_fallback, _type=type):"]
+    cells = []
+    for i, c in enumerate(columns):
+        lines.append(f"    v{i} = d.get({c!r})")
+        cells.append(f"_get(_type(v{i}), _fallback)(v{i})")
+    lines.append(f"    return ({', '.join(cells)},)")
+    namespace = {}
+    exec(
+        "\n".join(lines) + "\n",
+        {"_get": CONV.get, "_fallback": convert_fallback},
+        namespace,
+    )
+    return namespace["project"]
+
+def insert_batch(sql_conn, cursor, insert_stmt, rows):
+    """Insert and commit rows with a single executemany; on failure bisect the batch down to the failing row."""
+    try:
+        cursor.executemany(insert_stmt, rows)
+        sql_conn.commit()
+    except Exception:
+        # a failed executemany may already have inserted part of the batch: undo it before retrying the halves
+        # (earlier batches and halves are committed, so nothing kept is sent again)
+        sql_conn.rollback()
+        if len(rows) == 1:
+            logger.error("Insert failed for row with _id %s", rows[0][0])
+            raise
+        mid = len(rows) // 2
+        insert_batch(sql_conn, cursor, insert_stmt, rows[:mid])
+        insert_batch(sql_conn, cursor, insert_stmt, rows[mid:])
+
+def csv_value(value):
+    """Format a converted value as a BULK INSERT CSV field.
+
+    Only None is written as a bare empty field (loaded as NULL with KEEPNULLS); every other value is
+    quoted, so an empty string stays an empty string."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and not math.isfinite(value) or isinstance(value, decimal.Decimal) and not value.is_finite():
+        # FLOAT/DECIMAL columns cannot hold NaN or +-Infinity
+        return ""
+    if value is True:
+        text = "1"
+    elif value is False:
+        text = "0"
+    elif isinstance(value, datetime.datetime):
+        text = value.isoformat(sep=" ")
+    elif isinstance(value, bytes):
+        # char data converted to VARBINARY is read as hex digits
+        text = value.hex()
+    elif isinstance(value, decimal.Decimal):
+        # str() may use exponent notation (1E+3, 1E-7), which does not convert to DECIMAL
+        text = format(value, "f")
+    else:
+        text = str(value)
+    return '"' + text.replace('"', '""') + '"'
+
+def bulk_insert_rows(cursor, table_name, rows, staging_dir):
+    """Stage rows as a UTF-8 CSV file in staging_dir and load them with one BULK INSERT."""
+    fd, path = tempfile.mkstemp(suffix=".csv", prefix=f"{table_name}_", dir=staging_dir)
+    try:
+        with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
+            # written by hand rather than with csv.writer, which writes None and "" the same way
+            for row in rows:
+                f.write(",".join([csv_value(v) for v in row]) + "\n")
+        # BULK INSERT does not accept a parameter for the file name
+        sql_path = path.replace("'", "''")
+        cursor.execute(
+            f"BULK INSERT [dbo].[{table_name}] FROM '{sql_path}' "
+            f"WITH (FORMAT = 'CSV', FIRSTROW = 1, FIELDTERMINATOR = ',', ROWTERMINATOR = '0x0a', CODEPAGE = '65001', KEEPNULLS, TABLOCK)"
+        )
+    finally:
+        os.remove(path)
+
+def make_batch_writer(sql_conn, cursor, table_name, insert_stmt, staging_dir=None):
+    """Return a function that inserts and commits one batch of rows.
+
+    Uses BULK INSERT through staging_dir (default: BULK_STAGING_DIR) when set, and falls back to
+    fast_executemany for the rest of the load if the bulk path is not permitted."""
+    if staging_dir is None:
+        staging_dir = BULK_STAGING_DIR
+    use_bulk = bool(staging_dir)
+
+    def write_batch(rows):
+        nonlocal use_bulk
+        if use_bulk:
+            try:
+                bulk_insert_rows(cursor, table_name, rows, staging_dir)
+                sql_conn.commit()
+                return
+            except Exception as ex:
+                sql_conn.rollback()
+                use_bulk = False
+                logger.warning("BULK INSERT into [%s] failed (%s). Falling back to fast_executemany.", table_name, ex)
+        insert_batch(sql_conn, cursor, insert_stmt, rows)
+
+    return write_batch
+
+def decode_sample_docs(raw_docs):
+    """Decode sampled raw documents for insertion, dropping repeats ($sample may return a document twice)."""
+    docs = {}
+    for raw_doc in raw_docs:
+        doc = bson.decode(raw_doc.raw)
+        # key on the encoded _id: _id may be an (unhashable) embedded document
+        docs.setdefault(bson.encode({"_id": doc["_id"]}), doc)
+    return list(docs.values())
+
+async def read_documents(collection, queue, prefetched=(), session=None):
+    """Stream documents from the Mongo cursor into the queue, followed by a None sentinel.
+
+    prefetched: documents already read (schema sample); queued first and excluded from the query.
+    session: explicit session owning the no-timeout cursor."""
+    query, hint = {}, None
+    if prefetched:
+        for doc in prefetched:
+            await queue.put(doc)
+        query = {"_id": {"$nin": [doc["_id"] for doc in prefetched]}}
+        # keep a collection scan: the planner may otherwise walk the whole _id index for the $nin
+        hint = {"$natural": 1}
+    # one getMore per SQL batch: the client buffers at most BATCH_INSERT documents of BSON at a time
+    # (smaller batches mean more round-trips than the 16 MiB default, but bounded memory)
+    async with collection.find(query, batch_size=BATCH_INSERT, no_cursor_timeout=True, hint=hint,
+                               session=session) as cursor:
+        async for doc in cursor:
+            await queue.put(doc)
+    await queue.put(None)
+
+async def run_write_batch(write_batch, rows):
+    """Run write_batch on the default executor; if cancelled, wait for the running call before re-raising."""
+    future = asyncio.get_running_loop().run_in_executor(None, write_batch, rows)
+    try:
+        await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # the worker thread cannot be interrupted: let it finish with the cursor before the connection is closed
+        await asyncio.wait([future])
+        raise
+
+async def write_documents(queue, write_batch, project, table_name):
+    """Convert queued documents into rows and insert them in batches on a worker thread."""
+    rows = 0
+    buffer = []
+    while True:
+        doc = await queue.get()
+        if doc is None:
+            break
+        rows += 1
+        # rows are built directly as tuples: pyodbc binds parameters row-wise, so per-column buffers
+        # would have to be transposed back with zip() on every flush
+        buffer.append(project(doc))
+        if len(buffer) >= BATCH_INSERT:
+            # pyodbc blocks, so run it in the default executor while the reader keeps filling the queue
+            await run_write_batch(write_batch, buffer)
+            buffer = []
+            logger.info("[%s] Inserted %d rows...", table_name, rows)
+
+    # flush remaining rows
+    if buffer:
+        await run_write_batch(write_batch, buffer)
+    return rows
+
+async def copy_documents(mongo_uri, db_name, coll_name, write_batch, project, prefetched=()):
+    """Copy all documents of a collection into SQL, overlapping Mongo reads with SQL inserts."""
+    # bounded queue gives backpressure when SQL inserts fall behind
+    queue = asyncio.Queue(maxsize=2 * BATCH_INSERT)
+    # no_cursor_timeout only holds under an explicit session: an implicit one can still expire after 30 minutes
+    async with AsyncMongoClient(mongo_uri) as mongo_client, mongo_client.start_session() as session:
+        collection = mongo_client[db_name][coll_name]
+        reader = asyncio.ensure_future(read_documents(collection, queue, prefetched, session))
+        writer = asyncio.ensure_future(write_documents(queue, write_batch, project, coll_name))
+        done, pending = await asyncio.wait({reader, writer}, return_when=asyncio.FIRST_EXCEPTION)
+        # one side failed: stop the other one and surface the error
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            task.result()
+        return writer.result()
+
+def create_table_and_insert(mongo_collection, sql_conn, table_name, sample_size=1000, *, mongo_uri,
+                            post_load_indexes=None):
+    # mongo_uri must point at the same deployment as mongo_collection: the async copy opens its own client on it
+    sample_docs = []
+    stats, total = analyze_collection_schema(mongo_collection, sample_size=sample_size, sample_docs=sample_docs)
     # ensure _id exists in schema (if present)
     if "_id" not in stats:
         # maybe collection empty; choose to create empty table if needed
-        print("Warning: _id not present in scanned docs (collection may be empty). Creating table with only _id as NVARCHAR(24).")
-        stats["_id"] = {"types": {"objectid"}, "count":0, "max_str_len":24, "int_min":None, "int_max":None, "nullable": True}
+        stats["_id"] = {"types": TYPE_OID, "count":0, "max_str_len":24, "int_min":None, "int_max":None, "nullable": True, "ascii": True}
+        logger.warning("_id not present in scanned docs (collection may be empty). Creating table with only _id as %s.",
+                       sql_type_from_stats(stats["_id"]))
 
     # compute SQL types
     schema_map = {}
-    # keep deterministic order: put _id first then rest sorted
-    ordered_fields = ["_id"] + sorted([k for k in stats.keys() if k != "_id"])
+    # _id first, then fields in first-seen order (matches the documents' own key order for d.get probes);
+    # SORT_COLUMNS = 1 gives a deterministic alphabetical order instead
+    other_fields = [k for k in stats.keys() if k != "_id"]
+    if SORT_COLUMNS:
+        other_fields.sort()
+    ordered_fields = ["_id"] + other_fields
     for field in ordered_fields:
         sql_type = sql_type_from_stats(stats[field])
         schema_map[field] = sql_type
 
-    # create table
+    if ASCII_AS_VARCHAR:
+        if any(t.startswith("N") for t in schema_map.values()):
+            # pyodbc default: str parameters sent as UTF-16
+            sql_conn.setencoding(encoding="utf-16le")
+        else:
+            # every text column is VARCHAR holding ASCII: send str parameters as 1-byte UTF-8 instead of UTF-16
+            sql_conn.setencoding(encoding="utf-8")
+
+    # create table (heap only: indexes are built after the load, see post_load_indexes)
     cursor = sql_conn.cursor()
     create_stmt = build_create_table_statement(table_name, schema_map)
     cursor.execute(create_stmt)
     sql_conn.commit()
-    print(f"Table [{table_name}] ensured (created if missing).")
+    logger.info("Table [%s] ensured (created if missing).", table_name)
+    # a kept table may already have indexes: stop maintaining them row by row and rebuild them after the load
+    disabled_indexes = disable_nonclustered_indexes(sql_conn, table_name)
 
     # Insert data
     insert_cols = ordered_fields
     placeholders = ", ".join(["?"] * len(insert_cols))
     columns_sql = ", ".join([f"[{c}]" for c in insert_cols])
+    # fully logged: parameterized INSERT ... VALUES is never minimally logged, only the BULK INSERT path is
     insert_stmt = f"INSERT INTO [dbo].[{table_name}] ({columns_sql}) VALUES ({placeholders})"
 
-    batch = 0
-    rows = 0
-    for doc in mongo_collection.find({}):
-        rows += 1
-        values = []
-        for c in insert_cols:
-            values.append(convert_value_for_sql(doc.get(c)))
-        try:
-            cursor.execute(insert_stmt, tuple(values))
-        except Exception as ex:
-            # On insert error, try a safer conversion: dump complex to JSON strings
-            safe_vals = []
-            for v in values:
-                if isinstance(v, (dict, list)):
-                    safe_vals.append(json.dumps(v, default=str))
-                else:
-                    safe_vals.append(v)
-            cursor.execute(insert_stmt, tuple(safe_vals))
-        batch += 1
-        if batch >= BATCH_INSERT:
+    cursor.fast_executemany = True
+
+    try:
+        # stream documents through an async Mongo reader into a writer feeding pyodbc from a worker thread
+        rows = asyncio.run(copy_documents(
+            mongo_uri, mongo_collection.database.name, mongo_collection.name,
+            make_batch_writer(sql_conn, cursor, table_name, insert_stmt), build_row_projection(insert_cols),
+            decode_sample_docs(sample_docs),
+        ))
+
+        # final commit
+        sql_conn.commit()
+        logger.info("[%s] Insert finished. Total rows processed: %d", table_name, rows)
+    finally:
+        for index_name in disabled_indexes:
+            cursor.execute(f"ALTER INDEX [{index_name}] ON [dbo].[{table_name}] REBUILD")
             sql_conn.commit()
-            batch = 0
-            print(f"Inserted {rows} rows...")
+            logger.info("Index rebuilt: %s", index_name)
+
+    # build indexes once over the loaded data instead of maintaining them row by row
+    for index_name, index_stmt in (post_load_indexes or {}).items():
+        if index_exists(sql_conn, table_name, index_name):
+            logger.info("Index already exists: %s", index_name)
+            continue
+        cursor.execute(index_stmt)
+        sql_conn.commit()
+        logger.info("Index created: %s", index_stmt)
 
-    # final commit
+def disable_nonclustered_indexes(sql_conn, table_name):
+    """Disable the enabled non-unique nonclustered indexes of a table and return their names.
+
+    Unique indexes stay enabled so duplicates are still rejected during the load."""
+    cursor = sql_conn.cursor()
+    index_names = [row[0] for row in cursor.execute(
+        "SELECT name FROM sys.indexes WHERE object_id = OBJECT_ID(?) AND type = 2 AND is_unique = 0 AND is_disabled = 0",
+        f"dbo.{table_name}",
+    ).fetchall()]
+    for index_name in index_names:
+        cursor.execute(f"ALTER INDEX [{index_name}] ON [dbo].[{table_name}] DISABLE")
+        logger.info("Index disabled for the load: %s", index_name)
     sql_conn.commit()
-    print(f"Insert finished. Total rows processed: {rows}")
+    return index_names
 
-def main():
-    # connect mongo
-    mongo_client = pymongo.MongoClient(MONGO_URI)
-    mongo_db = mongo_client[MONGO_DB]
+def index_exists(sql_conn, table_name, index_name):
+    cursor = sql_conn.cursor()
+    row = cursor.execute(
+        "SELECT 1 FROM sys.indexes WHERE object_id = OBJECT_ID(?) AND name = ?", f"dbo.{table_name}", index_name
+    ).fetchone()
+    sql_conn.commit()
+    return row is not None
+
+def get_recovery_model(sql_conn):
+    """Return (database name, recovery model) of the connection's current database."""
+    cursor = sql_conn.cursor()
+    db_name, model = cursor.execute(
+        "SELECT name, recovery_model_desc FROM sys.databases WHERE name = DB_NAME()"
+    ).fetchone()
+    sql_conn.commit()
+    return db_name, model
+
+def set_recovery_model(sql_conn, db_name, model):
+    # ALTER DATABASE cannot run inside a user transaction
+    sql_conn.autocommit = True
+    try:
+        sql_conn.cursor().execute(f"ALTER DATABASE [{db_name}] SET RECOVERY {model}")
+    finally:
+        sql_conn.autocommit = False
+    logger.info("Database [%s] recovery model set to %s.", db_name, model)
+
+def configure_logging():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
-    # connect SQL Server
-    conn_str = (
+def sql_connection_string():
+    return (
         f"DRIVER={{ODBC Driver 17 for SQL Server}};"
         f"{SQL_CONN}"
     )
-    sql_conn = pyodbc.connect(conn_str, autocommit=False)
 
+def process_collection(coll_name, mongo_uri=MONGO_URI, mongo_db=MONGO_DB, sql_conn_str=None):
+    """Migrate one collection over its own Mongo and SQL Server connections (runs in a worker process)."""
+    mongo_client = pymongo.MongoClient(mongo_uri)
+    sql_conn = pyodbc.connect(sql_conn_str or sql_connection_string(), autocommit=False)
     try:
-        # split multiple collections by ;
-        for coll_name in COLLECTION_NAMES.split(";"):
-            coll_name = coll_name.strip()
-            if not coll_name:
-                continue
-            print(f"\n Processing collection: {coll_name}")
-            collection = mongo_db[coll_name]
-            create_table_and_insert(collection, sql_conn, coll_name, sample_size=SAMPLE_SIZE)
+        logger.info("Processing collection: %s", coll_name)
+        create_table_and_insert(
+            mongo_client[mongo_db][coll_name], sql_conn, coll_name, sample_size=SAMPLE_SIZE,
+            mongo_uri=mongo_uri, post_load_indexes=POST_LOAD_INDEXES.get(coll_name),
+        )
     finally:
         sql_conn.close()
         mongo_client.close()
+    return coll_name
+
+def main():
+    configure_logging()
+
+    # split multiple collections by ;
+    coll_names = [c.strip() for c in COLLECTION_NAMES.split(";") if c.strip()]
+
+    # FULL recovery logs every inserted row; switch to BULK_LOGGED for the load and restore afterwards
+    # (take a log backup after a bulk-logged load to keep point-in-time restore possible).
+    # Only BULK INSERT ... TABLOCK into a heap is minimally logged, so this needs BULK_STAGING_DIR.
+    if BULK_LOGGED_LOAD and not BULK_STAGING_DIR:
+        logger.warning("BULK_LOGGED_LOAD ignored: minimal logging only applies to the BULK_STAGING_DIR load path.")
+    sql_conn = pyodbc.connect(sql_connection_string(), autocommit=False) if BULK_LOGGED_LOAD and BULK_STAGING_DIR else None
+    db_name, recovery_model = get_recovery_model(sql_conn) if sql_conn else (None, None)
+    if recovery_model == "FULL":
+        set_recovery_model(sql_conn, db_name, "BULK_LOGGED")
+
+    try:
+        workers = max(1, min(len(coll_names), MAX_PARALLEL_COLLECTIONS, os.cpu_count() or 1))
+        if workers == 1:
+            for coll_name in coll_names:
+                process_collection(coll_name)
+        else:
+            # collections are independent: each worker process opens its own Mongo and SQL connections
+            with ProcessPoolExecutor(max_workers=workers, initializer=configure_logging) as executor:
+                for coll_name in executor.map(process_collection, coll_names):
+                    logger.info("Finished collection: %s", coll_name)
+    finally:
+        if sql_conn:
+            if recovery_model == "FULL":
+                set_recovery_model(sql_conn, db_name, "FULL")
+            sql_conn.close()
 
 if __name__ == "__main__":
     main()